@@ -1,5 +1,6 @@
 from src.common.utils import Settings
 from src.datastore import CreateDataStore
+from src.precompute import PrecomputeResults
 from src.query_api import CDRCQuery
 
 
@@ -19,6 +20,14 @@ def main():
         except Exception as e:
             print(e)
             print("Datastore failed to run. Check the logs for more information.")
+            return
+
+        precompute = PrecomputeResults(**Settings().precompute.model_dump())
+        try:
+            precompute.run()
+        except Exception as e:
+            print(e)
+            print("Precompute failed to run. Check the logs for more information.")
 
 
 if __name__ == "__main__":
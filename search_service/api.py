@@ -1,19 +1,113 @@
+import json
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import date
 from uuid import UUID, uuid4
 
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
 
+from src.common.logging import logger
+from src.common.metrics import (
+    PRECOMPUTED_LOOKUPS,
+    REGISTRY,
+    REQUEST_SECONDS,
+    REQUESTS,
+    STARTUP_SECONDS,
+    profile,
+)
+from src.common.session_store import session_store_from_url
 from src.common.utils import Settings
-from src.model import LlamaIndexModel
+from src.filter_index import DocumentFormat, SearchFilters
+from src.precompute import (
+    load_precomputed_results,
+    normalise_query,
+    results_content,
+)
 
-app = FastAPI()
-model_instances = {}
-query_mapping = {}
 
+def load_engine(app: FastAPI) -> None:
+    """Import the search stack, build the shared index and run warm-up queries.
 
-def get_model(results_id: UUID) -> LlamaIndexModel:
-    if results_id not in model_instances:
-        model_instances[results_id] = LlamaIndexModel(**Settings().model.model_dump())
-    return model_instances[results_id]
+    This runs in a background thread so the service can answer liveness probes
+    and precomputed queries while the engine loads.
+    """
+    try:
+        start = time.perf_counter()
+        from src.model import LlamaIndexModel
+
+        STARTUP_SECONDS.set(time.perf_counter() - start, phase="import")
+
+        start = time.perf_counter()
+        app.state.engine = LlamaIndexModel(**Settings().model.model_dump())
+        STARTUP_SECONDS.set(time.perf_counter() - start, phase="engine")
+
+        start = time.perf_counter()
+        for q in Settings().service.warmup_queries:
+            app.state.engine.run(q)
+        STARTUP_SECONDS.set(time.perf_counter() - start, phase="warmup")
+    except Exception:
+        logger.exception("Failed to load the search engine.")
+        app.state.startup_error = True
+        return
+
+    app.state.ready = True
+    logger.info("Search engine ready.")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    app.state.startup_error = False
+    app.state.precomputed_results = load_precomputed_results()
+    app.state.sessions = session_store_from_url(Settings().service.session_store)
+    threading.Thread(target=load_engine, args=(app,), daemon=True).start()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+metrics_settings = Settings().metrics
+session_ttl = Settings().service.session_ttl
+
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    start = time.perf_counter()
+    with profile(
+        f"{request.method} {request.url.path}?{request.url.query}",
+        slow_seconds=metrics_settings.slow_request_seconds,
+        profile_dir=metrics_settings.profile_dir,
+    ):
+        response = await call_next(request)
+
+    # label by route template so that results ids do not explode the label set
+    route = request.scope.get("route")
+    endpoint = route.path if route else "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    return response
+
+
+def get_model():
+    """Create a model for a single request, sharing this worker's index.
+
+    Session state lives in the shared store rather than the model, so any worker
+    can serve any results id.
+    """
+    if not app.state.ready:
+        raise HTTPException(status_code=503, detail="Search engine is not ready")
+
+    from src.model import LlamaIndexModel
+
+    return LlamaIndexModel(
+        **Settings().model.model_dump(), index=app.state.engine.index
+    )
+
+
+def get_query(results_id: UUID) -> str | None:
+    q = app.state.sessions.get(f"query:{results_id}")
+    return q.decode() if q is not None else None
 
 
 @app.get("/")
@@ -21,44 +115,93 @@ def index():
     return {"message": "Make a post request to /query."}
 
 
+@app.get("/healthz")
+def healthz() -> dict:
+    if app.state.startup_error:
+        raise HTTPException(status_code=500, detail="Search engine failed to load")
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz() -> dict:
+    if not app.state.ready:
+        raise HTTPException(status_code=503, detail="Search engine is not ready")
+    return {"status": "ready"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> str:
+    """Metrics for the worker that handles the scrape, labelled with its pid."""
+    return REGISTRY.render()
+
+
 @app.post("/query")
-async def query(q: str) -> dict:
+def query(q: str) -> dict:
     results_id = uuid4()
-    query_mapping[results_id] = q
+    app.state.sessions.set(f"query:{results_id}", q, ex=session_ttl)
     return {"results_id": results_id, "query": q}
 
 
 @app.get("/results/{results_id}")
-async def results(
-    results_id: UUID, model: LlamaIndexModel = Depends(get_model)
+def results(
+    results_id: UUID,
+    created_after: date | None = None,
+    created_before: date | None = None,
+    formats: list[DocumentFormat] | None = Query(None),
+    dataset_ids: list[str] | None = Query(None),
 ) -> dict:
-    if results_id not in query_mapping:
+    q = get_query(results_id)
+    if q is None:
         return {"error": "No query found for the provided results_id"}
 
-    q = query_mapping[results_id]
-    model.run(q)
+    filters = SearchFilters(
+        created_after=created_after,
+        created_before=created_before,
+        formats=formats,
+        dataset_ids=dataset_ids,
+    )
+    response = None
+    # the precomputed results are unfiltered
+    if filters.is_empty():
+        response = app.state.precomputed_results.get(normalise_query(q))
+        PRECOMPUTED_LOOKUPS.inc(hit=str(response is not None).lower())
+    if response is None:
+        model = get_model()
+        model.run(q, filters)
+        response = model.dump_response()
+    # explain must use the same nodes the user was shown
+    app.state.sessions.set(
+        f"results:{results_id}", json.dumps(response), ex=session_ttl
+    )
     return {
-        "results_content": model.processed_response,
+        "results_content": results_content(response),
         "metadata": {
             "results_id": results_id,
             "query": q,
+            "filters": filters.model_dump(exclude_none=True),
         },
     }
 
 
 @app.get("/explain/{results_id}")
-async def explain(
-    response_num: int, results_id: UUID, model: LlamaIndexModel = Depends(get_model)
-) -> dict:
-    if results_id not in query_mapping:
+def explain(response_num: int, results_id: UUID, model=Depends(get_model)) -> dict:
+    q = get_query(results_id)
+    if q is None:
         return {"error": "No query found for the provided results_id"}
 
+    # results that were never requested have no retrieved nodes to explain
+    response = app.state.sessions.get(f"results:{results_id}")
+    if response is None:
+        model.run(q)
+    else:
+        model.load_response(q, json.loads(response))
+
     model.explain_dataset(response_num)
     return {
         "explained_response": model.explained_response,
         "metadata": {
             "results_id": results_id,
-            "query": query_mapping[results_id],
+            "query": q,
             "related_dataset": model.processed_response[response_num],
         },
     }
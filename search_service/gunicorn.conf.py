@@ -0,0 +1,9 @@
+import multiprocessing
+import os
+
+# each worker loads its own engine, while session state is shared through the
+# configured session store and the local index files are memory mapped
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
@@ -9,14 +9,30 @@ def main():
     st.title("CDRC Semantic Search App")
 
     with st.spinner("Loading..."):
+        server = None
         while True:
             try:
-                r = requests.get("http://localhost:8000/")
+                r = requests.get("http://localhost:8000/healthz")
+                if r.status_code == 500:
+                    st.error(
+                        f"The search service failed to start: {r.json()['detail']}"
+                    )
+                    return None
+                r = requests.get("http://localhost:8000/readyz")
                 if r.status_code == 200:
                     break
             except requests.exceptions.ConnectionError:
-                Popen(["uvicorn", "search_service.api:app", "--port", "8000"])
-                sleep(10)
+                if server is not None and server.poll() is not None:
+                    st.error(
+                        "The search service exited with code "
+                        f"{server.returncode}, check its logs."
+                    )
+                    return None
+                if server is None:
+                    server = Popen(
+                        ["uvicorn", "search_service.api:app", "--port", "8000"]
+                    )
+            sleep(0.5)
 
     # use_llm = st.toggle("Activate LLM")
     use_llm = False
@@ -0,0 +1,185 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from uuid import uuid4
+
+from src.common.logging import logger
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_profile: ContextVar[list[dict] | None] = ContextVar("profile", default=None)
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: dict[tuple, float] = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] += amount
+
+    def samples(self, extra_labels: tuple[tuple[str, str], ...] = ()):
+        with self.lock:
+            for labels, value in self.values.items():
+                yield f"{self.name}{_format_labels((*extra_labels, *labels))} {value}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = (*sorted(buckets), math.inf)
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts = self.counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.sums[key] += value
+
+    def samples(self, extra_labels: tuple[tuple[str, str], ...] = ()):
+        with self.lock:
+            for key, counts in self.counts.items():
+                labels = (*extra_labels, *key)
+                for bound, count in zip(self.buckets, counts):
+                    le = "+Inf" if bound == math.inf else str(bound)
+                    bucket_labels = _format_labels((*labels, ("le", le)))
+                    yield f"{self.name}_bucket{bucket_labels} {count}"
+                yield f"{self.name}_sum{_format_labels(labels)} {self.sums[key]}"
+                yield f"{self.name}_count{_format_labels(labels)} {counts[-1]}"
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        with self.lock:
+            return {
+                ",".join(value for _, value in labels): {
+                    "count": counts[-1],
+                    "seconds": round(self.sums[labels], 3),
+                }
+                for labels, counts in self.counts.items()
+            }
+
+
+class Registry:
+    """Metrics held in this process.
+
+    Under gunicorn each worker has its own registry, so rendered samples are
+    labelled with the worker pid rather than summed across workers.
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, Counter | Gauge | Histogram] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help))  # type: ignore
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self.metrics.setdefault(name, Gauge(name, help))  # type: ignore
+
+    def histogram(self, name: str, help: str, **kwargs) -> Histogram:
+        histogram = Histogram(name, help, **kwargs)
+        return self.metrics.setdefault(name, histogram)  # type: ignore
+
+    def render(self) -> str:
+        # read at render time as workers are forked after this module is imported
+        pid = (("pid", str(os.getpid())),)
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples(pid))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "cdrc_stage_duration_seconds", "Time spent in each search or ingestion stage."
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "cdrc_stage_errors_total", "Number of stages that raised an exception."
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "cdrc_request_duration_seconds", "Time spent handling each API request."
+)
+REQUESTS = REGISTRY.counter("cdrc_requests_total", "Number of API requests handled.")
+STARTUP_SECONDS = REGISTRY.gauge(
+    "cdrc_startup_seconds", "Time spent in each phase of service startup."
+)
+PRECOMPUTED_LOOKUPS = REGISTRY.counter(
+    "cdrc_precomputed_lookups_total", "Queries checked against the precomputed results."
+)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage, recording it in the stage histogram and any active profile."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        logger.debug(f"{stage} took {seconds:.3f}s")
+
+        spans = _profile.get()
+        if spans is not None:
+            spans.append({"stage": stage, "seconds": round(seconds, 6)})
+
+
+@contextmanager
+def profile(name: str, slow_seconds: float, profile_dir: Path | None = None):
+    """Collect the spans run within a request and dump them if it is slow."""
+    spans: list[dict] = []
+    token = _profile.set(spans)
+    start = time.perf_counter()
+    try:
+        yield spans
+    finally:
+        _profile.reset(token)
+        seconds = time.perf_counter() - start
+        if seconds >= slow_seconds:
+            report = {"name": name, "seconds": round(seconds, 6), "spans": spans}
+            logger.warning(f"Slow request {name} took {seconds:.3f}s: {spans}")
+            if profile_dir is not None:
+                profile_dir.mkdir(parents=True, exist_ok=True)
+                with open(profile_dir / f"{int(time.time())}-{uuid4()}.json", "w") as f:
+                    json.dump(report, f, indent=2)
+
+
+def log_stage_summary() -> None:
+    for stage, summary in STAGE_SECONDS.summary().items():
+        logger.info(f"{stage}: {summary['count']} run(s), {summary['seconds']}s")
@@ -0,0 +1,133 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Protocol
+
+from src.common.utils import ROOT_DIR
+
+
+class SessionStore(Protocol):
+    """The subset of the redis-py client used to share session state.
+
+    Anything implementing it can back the API, so a Redis server can replace the
+    local stores below without code changes.
+    """
+
+    def get(self, name: str) -> bytes | None: ...
+
+    def set(self, name: str, value: str | bytes, ex: int | None = None) -> bool: ...
+
+    def delete(self, *names: str) -> int: ...
+
+    def exists(self, *names: str) -> int: ...
+
+
+class MemoryStore:
+    """Process-local store, only suitable when running a single worker."""
+
+    def __init__(self):
+        self.values: dict[str, tuple[bytes, float | None]] = {}
+        self.lock = threading.Lock()
+
+    def get(self, name: str) -> bytes | None:
+        with self.lock:
+            if name not in self.values:
+                return None
+            value, expires = self.values[name]
+            if expires is not None and expires < time.time():
+                del self.values[name]
+                return None
+            return value
+
+    def set(self, name: str, value: str | bytes, ex: int | None = None) -> bool:
+        if isinstance(value, str):
+            value = value.encode()
+        with self.lock:
+            self.values[name] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *names: str) -> int:
+        with self.lock:
+            return sum(self.values.pop(name, None) is not None for name in names)
+
+    def exists(self, *names: str) -> int:
+        return sum(self.get(name) is not None for name in names)
+
+
+class SQLiteStore:
+    """Store shared between worker processes through a SQLite file in WAL mode.
+
+    WAL lets readers in every worker proceed while another worker writes. Each
+    thread opens its own connection as SQLite connections cannot be shared.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.local = threading.local()
+
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(name TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)"
+            )
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if not hasattr(self.local, "connection"):
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return self.local.connection
+
+    def get(self, name: str) -> bytes | None:
+        row = self.connection.execute(
+            "SELECT value FROM sessions WHERE name = ? "
+            "AND (expires IS NULL OR expires >= ?)",
+            (name, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, name: str, value: str | bytes, ex: int | None = None) -> bool:
+        if isinstance(value, str):
+            value = value.encode()
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (name, value, now + ex if ex else None),
+            )
+            self.connection.execute("DELETE FROM sessions WHERE expires < ?", (now,))
+        return True
+
+    def delete(self, *names: str) -> int:
+        with self.connection:
+            return self.connection.executemany(
+                "DELETE FROM sessions WHERE name = ?", [(name,) for name in names]
+            ).rowcount
+
+    def exists(self, *names: str) -> int:
+        return sum(self.get(name) is not None for name in names)
+
+
+def session_store_from_url(url: str) -> SessionStore:
+    """Create a store from ``memory://``, ``sqlite:///path`` or ``redis://`` urls.
+
+    Relative sqlite paths are resolved from the repository root.
+    """
+    if url.startswith("memory://"):
+        return MemoryStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(ROOT_DIR / url.removeprefix("sqlite:///"))
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("Install redis to use a Redis session store.") from e
+        return redis.Redis.from_url(url)
+    raise ValueError(f"Unsupported session store {url}")
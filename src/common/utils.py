@@ -1,15 +1,22 @@
+import os
 import tomllib
+from functools import cache
 from pathlib import Path
 
 from dotenv import load_dotenv
-from pydantic import Field
+from pydantic import Field, field_validator, model_validator
 from pydantic_settings import BaseSettings
 
 load_dotenv()
 
+ROOT_DIR = Path(__file__).resolve().parents[2]
+CONFIG_PATH = Path(os.getenv("CDRC_CONFIG", ROOT_DIR / "config" / "config.toml"))
 
-with open("./config/config.toml", "rb") as f:
-    Config = tomllib.load(f)
+
+@cache
+def load_config() -> dict:
+    with open(CONFIG_PATH, "rb") as f:
+        return tomllib.load(f)
 
 
 class CDRCSettings(BaseSettings):
@@ -23,6 +30,13 @@ class DataStoreSettings(BaseSettings):
     chunk_size: int = Field(gt=0, le=10_000)
     chunk_overlap: int = Field(ge=0, le=10_000)
     overwrite: bool
+    scan_dim: int = Field(gt=0, le=10_000)
+
+    @model_validator(mode="after")
+    def check_scan_dim(self):
+        if self.scan_dim > self.embed_dim:
+            raise ValueError("scan_dim must not exceed embed_dim")
+        return self
 
 
 class ModelSettings(BaseSettings):
@@ -31,17 +45,67 @@ class ModelSettings(BaseSettings):
     alpha: float = Field(gt=0, le=1)
     prompt: str = Field(min_length=1)
     response_mode: str = Field(min_length=1)
+    backend: str = Field(pattern="pinecone|local")
+
+
+class VectorIndexSettings(BaseSettings):
+    quantisation: str = Field(pattern="float32|int8|binary")
+    oversample: int = Field(gt=0, le=100)
+
+
+class PrecomputeSettings(BaseSettings):
+    top_n: int = Field(gt=0, le=10_000)
+
+
+class MetricsSettings(BaseSettings):
+    slow_request_seconds: float = Field(gt=0)
+    profile_dir: Path | None = None
+
+    @field_validator("profile_dir")
+    @classmethod
+    def anchor_profile_dir(cls, profile_dir: Path | None) -> Path | None:
+        return ROOT_DIR / profile_dir if profile_dir is not None else None
+
+
+class ServiceSettings(BaseSettings):
+    warmup_queries: list[str] = []
+    session_store: str = Field(min_length=1)
+    session_ttl: int = Field(gt=0)
+
+
+class ExportSettings(BaseSettings):
+    batch_size: int = Field(gt=0, le=1000)
+    layout: str | None = Field(default=None, pattern="pca|random")
+
+
+def _from_config(settings: type[BaseSettings], section: str):
+    return Field(
+        default_factory=lambda: settings.model_validate(load_config()[section])
+    )
 
 
 class Settings(BaseSettings):
-    model: ModelSettings = ModelSettings.model_validate(Config["model"])
-    datastore: DataStoreSettings = DataStoreSettings.model_validate(Config["datastore"])
-    cdrc: CDRCSettings = CDRCSettings.model_validate(Config["cdrc-api"])
+    model: ModelSettings = _from_config(ModelSettings, "model")
+    datastore: DataStoreSettings = _from_config(DataStoreSettings, "datastore")
+    cdrc: CDRCSettings = _from_config(CDRCSettings, "cdrc-api")
+    precompute: PrecomputeSettings = _from_config(PrecomputeSettings, "precompute")
+    metrics: MetricsSettings = _from_config(MetricsSettings, "metrics")
+    service: ServiceSettings = _from_config(ServiceSettings, "service")
+    vector_index: VectorIndexSettings = _from_config(
+        VectorIndexSettings, "vector_index"
+    )
+    export: ExportSettings = _from_config(ExportSettings, "export")
 
 
 class Paths:
-    DATA_DIR: Path = Path("data")
+    DATA_DIR: Path = ROOT_DIR / "data"
     PROFILES_DIR: Path = DATA_DIR / "profiles"
     DOCS_DIR: Path = PROFILES_DIR / "docs"
     NOTES_DIR: Path = PROFILES_DIR / "notes"
-    PIPELINE_STORAGE: Path = Path("./pipeline_storage")
+    LOGS_DIR: Path = DATA_DIR / "logs"
+    QUERY_LOG: Path = LOGS_DIR / "queries.csv"
+    VECTORS_DIR: Path = DATA_DIR / "vectors"
+    DATASTORE_BUILD: Path = VECTORS_DIR / "build.json"
+    EXPORT_DIR: Path = DATA_DIR / "export"
+    PRECOMPUTED_RESULTS: Path = DATA_DIR / "precomputed-results.json"
+    PIPELINE_STORAGE: Path = ROOT_DIR / "pipeline_storage"
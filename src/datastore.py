@@ -2,21 +2,32 @@ import json
 import logging
 import os
 import shutil
+from datetime import datetime
 from pathlib import Path
+from uuid import uuid4
 
-import dateparser
-from llama_index.core import SimpleDirectoryReader
-from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.embeddings.openai import OpenAIEmbedding, OpenAIEmbeddingMode
 from llama_index.vector_stores.pinecone import PineconeVectorStore
-from llama_parse import LlamaParse
 from pinecone import Pinecone, PodSpec
 
+from src.common.metrics import log_stage_summary, span
 from src.common.utils import Paths, Settings
+from src.vector_index import QuantisedVectorIndex, truncate, write_vectors
 
+EXCLUDED_METADATA_KEYS = [
+    "id",
+    "url",
+    "filename",
+    "format",
+    "date_created",
+    "created_timestamp",
+]
+
+
+def _add_metadata_to_document(doc_id: str) -> dict[str, str | int]:
+    import dateparser
 
-def _add_metadata_to_document(doc_id: str) -> dict[str, str]:
     with open(Paths.DATA_DIR / "catalogue-metadata.json") as f:
         catalogue_metadata = json.load(f)
     with open(Paths.DATA_DIR / "files-metadata.json") as f:
@@ -24,20 +35,25 @@ def _add_metadata_to_document(doc_id: str) -> dict[str, str]:
 
     format, main_id = doc_id.split("-", maxsplit=1)
 
+    created = None
     if format != "notes":
         for file_meta in files_metadata:
             if main_id == file_meta["id"]:
                 main_id = file_meta["parent_id"]
+                created = file_meta["created"]
                 break
 
-    iso_date = dateparser.parse(files_metadata[0]["created"]).isoformat()  # type: ignore
     for cm in catalogue_metadata:
         if main_id == cm["id"]:
+            date = dateparser.parse(created or cm["metadata_created"])
             return {
                 "title": cm["title"],
                 "id": cm["id"],
                 "url": cm["url"],
-                "date_created": iso_date,
+                "format": format,
+                "date_created": date.isoformat(),  # type: ignore
+                # numeric copy of the date so the vector store can range filter it
+                "created_timestamp": int(date.timestamp()),  # type: ignore
             }
     raise ValueError(f"Metadata not found for document {doc_id}")
 
@@ -50,18 +66,22 @@ class CreateDataStore:
         chunk_overlap: int,
         overwrite: bool,
         embed_dim: int,
+        scan_dim: int,
         profiles_dir: Path = Paths.PROFILES_DIR,
         data_dir: Path = Paths.DATA_DIR,
         pipeline_storage: Path = Paths.PIPELINE_STORAGE,
+        vectors_dir: Path = Paths.VECTORS_DIR,
     ):
         self.index_name = index_name
         self.overwrite = overwrite
         self.profiles_dir = profiles_dir
         self.data_dir = data_dir
         self.embed_dim = embed_dim
+        self.scan_dim = scan_dim
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.pipeline_storage = pipeline_storage
+        self.vectors_dir = vectors_dir
 
         self.pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
 
@@ -74,14 +94,25 @@ class CreateDataStore:
         self.setup_directory_reader()
         self.setup_ingestion_pipeline()
         self.load_and_preprocess_documents()
+        self.write_build_stamp()
 
         shutil.rmtree(self.profiles_dir)
+        log_stage_summary()
+
+    def write_build_stamp(self):
+        """Identify this build so results derived from it can be versioned."""
+        with open(self.vectors_dir / "build.json", "w") as f:
+            json.dump(
+                {"build_id": uuid4().hex, "built_at": datetime.now().isoformat()}, f
+            )
 
     def initialise_pinecone_index(self):
+        # nodes added to an existing index are added to the local vectors too
+        self.append_vectors = False
         if self.index_name not in self.pc.list_indexes().names():
             self.pc.create_index(
                 name=self.index_name,
-                dimension=self.embed_dim,
+                dimension=self.scan_dim,
                 metric="cosine",
                 spec=PodSpec(environment=os.environ["PINECONE_ENVIRONMENT"]),
             )
@@ -89,12 +120,18 @@ class CreateDataStore:
             self.pc.delete_index(self.index_name)
             self.pc.create_index(
                 name=self.index_name,
-                dimension=self.embed_dim,
+                dimension=self.scan_dim,
                 metric="cosine",
                 spec=PodSpec(environment=os.environ["PINECONE_ENVIRONMENT"]),
             )
+        else:
+            self.append_vectors = True
 
     def setup_directory_reader(self):
+        # parsing dependencies are heavy and only needed for ingestion
+        from llama_index.core import SimpleDirectoryReader
+        from llama_parse import LlamaParse
+
         pdf_reader = LlamaParse()
         self.dir_reader = SimpleDirectoryReader(
             str(self.profiles_dir),
@@ -103,38 +140,55 @@ class CreateDataStore:
             file_metadata=lambda name: _add_metadata_to_document(Path(name).stem),
         )
 
-    def setup_ingestion_pipeline(self):
+    def setup_vector_store(self):
         self.vector_store = PineconeVectorStore(
             pinecone_index=self.pc.Index(self.index_name)
         )
-        self.pipeline = IngestionPipeline(
-            transformations=[
-                SentenceSplitter(
-                    chunk_size=self.chunk_size,
-                    chunk_overlap=self.chunk_overlap,
-                ),
-                OpenAIEmbedding(
-                    mode=OpenAIEmbeddingMode.TEXT_SEARCH_MODE,
-                    model="text-embedding-3-large",
-                    api_key=os.environ["OPENAI_API_KEY"],
-                ),
-            ],
-            vector_store=self.vector_store,
+
+    def setup_ingestion_pipeline(self):
+        self.setup_vector_store()
+        self.splitter = SentenceSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+        )
+        self.embed_model = OpenAIEmbedding(
+            mode=OpenAIEmbeddingMode.TEXT_SEARCH_MODE,
+            model="text-embedding-3-large",
+            api_key=os.environ["OPENAI_API_KEY"],
         )
 
     def load_and_preprocess_documents(self):
-        self.docs = self.dir_reader.load_data(show_progress=True)
+        with span("ingest.parse"):
+            self.docs = self.dir_reader.load_data(show_progress=True)
         for doc in self.docs:
-            doc.excluded_embed_metadata_keys.extend(
-                ["id", "url", "filename", "date_created"]
+            doc.excluded_embed_metadata_keys.extend(EXCLUDED_METADATA_KEYS)
+            doc.excluded_llm_metadata_keys.extend(EXCLUDED_METADATA_KEYS)
+
+        # stages are run individually, rather than through an IngestionPipeline,
+        # so that each one can be timed
+        with span("ingest.split"):
+            nodes = self.splitter(self.docs, show_progress=True)
+        with span("ingest.embed"):
+            nodes = self.embed_model(nodes, show_progress=True)
+        nodes = [node for node in nodes if node.embedding is not None]
+        with span("ingest.local_vectors"):
+            write_vectors(nodes, self.vectors_dir, append=self.append_vectors)
+            QuantisedVectorIndex(
+                **Settings().vector_index.model_dump(),
+                scan_dim=self.scan_dim,
+                vectors_dir=self.vectors_dir,
             )
-            doc.excluded_llm_metadata_keys.extend(
-                ["id", "url", "filename", "date_created"]
-            )
-
-        self.pipeline.run(documents=self.docs)
+        # the vector store only holds the truncated embeddings, the full ones are
+        # kept locally for re-ranking
+        if self.scan_dim < self.embed_dim:
+            for node in nodes:
+                node.embedding = truncate(node.embedding, self.scan_dim).tolist()
+        with span("ingest.upsert"):
+            self.vector_store.add(nodes)
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
     datastore = CreateDataStore(**Settings().datastore.model_dump())
     datastore.run()
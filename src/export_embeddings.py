@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from pinecone import Pinecone
+from tqdm import tqdm
+
+from src.common.metrics import log_stage_summary, span
+from src.common.utils import Paths, Settings
+from src.vector_index import SCAN_BATCH_SIZE, write_ids
+
+
+class ExportEmbeddings:
+    """Page every vector out of the Pinecone index into memory mapped arrays.
+
+    Writes the same layout as the local vector index, ``embeddings.npy`` with one
+    row per line of ``nodes.jsonl``, so vectors are streamed straight to disk and
+    the export can also seed ``data/vectors``. Pod indexes cannot list their ids,
+    so for those the full dimension vectors in ``data/vectors`` are copied instead.
+    """
+
+    def __init__(
+        self,
+        index_name: str,
+        embed_dim: int,
+        batch_size: int,
+        layout: str | None,
+        out_dir: Path = Paths.EXPORT_DIR,
+        vectors_dir: Path = Paths.VECTORS_DIR,
+    ):
+        self.index_name = index_name
+        self.embed_dim = embed_dim
+        self.batch_size = batch_size
+        self.layout = layout
+        self.out_dir = out_dir
+        self.vectors_dir = vectors_dir
+
+        self.pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
+        self.index = self.pc.Index(index_name)
+
+    def run(self):
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        with span("export.fetch"):
+            if self.can_list_ids():
+                self.export_vectors()
+            else:
+                logging.warning(
+                    f"{self.index_name} cannot list its ids, "
+                    f"copying the vectors in {self.vectors_dir} instead."
+                )
+                self.copy_local_vectors()
+        if self.layout is not None:
+            with span("export.layout"):
+                self.write_layout()
+        log_stage_summary()
+
+    def can_list_ids(self) -> bool:
+        # list is only supported by serverless indexes
+        spec = self.pc.describe_index(self.index_name).spec
+        return getattr(spec, "serverless", None) is not None
+
+    def copy_local_vectors(self) -> None:
+        for name in ["embeddings.npy", "nodes.jsonl", "ids.npy", "id_order.npy"]:
+            shutil.copyfile(self.vectors_dir / name, self.out_dir / name)
+
+    def export_vectors(self) -> None:
+        # the stats are eventually consistent, so the file grows if more are listed
+        total = self.index.describe_index_stats().total_vector_count
+        path = self.out_dir / "embeddings.npy"
+        capacity = max(total, self.batch_size)
+        embeddings = np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.float32, shape=(capacity, self.embed_dim)
+        )
+
+        row, exported_ids, missing = 0, [], 0
+        with open(self.out_dir / "nodes.jsonl", "w") as f, tqdm(total=total) as pbar:
+            for ids in self.index.list(limit=self.batch_size):
+                vectors = self.index.fetch(ids=ids).vectors
+                missing += sum(id not in vectors for id in ids)
+                ids = [id for id in ids if id in vectors]
+                if row + len(ids) > capacity:
+                    capacity = max(2 * capacity, row + len(ids))
+                    embeddings.flush()
+                    del embeddings
+                    _resize_rows(path, capacity)
+                    embeddings = np.load(path, mmap_mode="r+")
+                for id in ids:
+                    values = np.asarray(vectors[id].values, dtype=np.float32)
+                    embeddings[row] = values / np.linalg.norm(values)
+                    f.write(json.dumps(_node_record(id, vectors[id])) + "\n")
+                    exported_ids.append(id)
+                    row += 1
+                pbar.update(len(ids))
+        embeddings.flush()
+        del embeddings
+        _resize_rows(path, row)
+        write_ids(exported_ids, self.out_dir)
+
+        if missing:
+            logging.warning(
+                f"Skipped {missing} listed id(s) that could not be fetched."
+            )
+        if row != total:
+            logging.warning(f"Index stats reported {total} vectors but exported {row}.")
+
+    def write_layout(self) -> None:
+        """Project the embeddings to 2-D, streaming over the memory mapped rows."""
+        embeddings = np.load(self.out_dir / "embeddings.npy", mmap_mode="r")
+        dim = embeddings.shape[1]
+        if self.layout == "pca":
+            mean = np.zeros(dim)
+            scatter = np.zeros((dim, dim))
+            for start in range(0, len(embeddings), SCAN_BATCH_SIZE):
+                batch = embeddings[start : start + SCAN_BATCH_SIZE].astype(np.float64)
+                mean += batch.sum(axis=0)
+                scatter += batch.T @ batch
+            mean /= len(embeddings)
+            covariance = scatter / len(embeddings) - np.outer(mean, mean)
+            _, eigenvectors = np.linalg.eigh(covariance)
+            components = eigenvectors[:, ::-1][:, :2].astype(np.float32)
+        elif self.layout == "random":
+            rng = np.random.default_rng(0)
+            mean = np.zeros(dim)
+            components = rng.normal(size=(dim, 2)).astype(np.float32)
+        else:
+            raise ValueError(f"Unknown layout {self.layout}")
+
+        layout = np.lib.format.open_memmap(
+            self.out_dir / "layout.npy",
+            mode="w+",
+            dtype=np.float32,
+            shape=(len(embeddings), 2),
+        )
+        for start in range(0, len(embeddings), SCAN_BATCH_SIZE):
+            batch = embeddings[start : start + SCAN_BATCH_SIZE] - mean
+            layout[start : start + SCAN_BATCH_SIZE] = batch @ components
+        layout.flush()
+
+
+def _resize_rows(path: Path, rows: int) -> None:
+    """Grow or shrink a ``.npy`` file to ``rows`` rows without loading it.
+
+    The header is rewritten in place, padded to its original length, and the file
+    is cut off or extended with zeros after the last row.
+    """
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        prefix = f.tell()
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            prefix += 2
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            prefix += 4
+        offset = f.tell()
+        header = {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": fortran_order,
+            "shape": (rows, *shape[1:]),
+        }
+        header = repr(header).encode("latin1")
+        if len(header) >= offset - prefix:
+            raise ValueError(f"No room in the header of {path} for {rows} rows.")
+        f.seek(prefix)
+        f.write(header.ljust(offset - prefix - 1) + b"\n")
+        f.truncate(offset + rows * int(np.prod(shape[1:])) * dtype.itemsize)
+
+
+def _node_record(id: str, vector) -> dict:
+    metadata = dict(vector.metadata or {})
+    # llama-index stores the serialised node, including its text, in the metadata
+    node_content = json.loads(metadata.pop("_node_content", "{}"))
+    for key in ["_node_type", "document_id", "doc_id", "ref_doc_id"]:
+        metadata.pop(key, None)
+    return {"id": id, "text": node_content.get("text", ""), "metadata": metadata}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    settings = Settings()
+    export = ExportEmbeddings(
+        index_name=settings.datastore.index_name,
+        # pinecone only holds the truncated embeddings when scan_dim < embed_dim
+        embed_dim=settings.datastore.scan_dim,
+        **settings.export.model_dump(),
+    )
+    export.run()
@@ -0,0 +1,98 @@
+from datetime import date, datetime, time
+from typing import Literal
+
+import numpy as np
+from pydantic import BaseModel
+
+# the document formats written to the "format" metadata during ingestion
+DocumentFormat = Literal["notes", "profile", "flyer"]
+
+
+class SearchFilters(BaseModel):
+    created_after: date | None = None
+    created_before: date | None = None
+    formats: list[DocumentFormat] | None = None
+    dataset_ids: list[str] | None = None
+
+    def is_empty(self) -> bool:
+        return not any(self.model_dump().values())
+
+    def to_metadata_filters(self):
+        """Compile the filters for vector stores that filter natively."""
+        # imported here so the API can parse filters without the llama-index stack
+        from llama_index.core.vector_stores import (
+            FilterOperator,
+            MetadataFilter,
+            MetadataFilters,
+        )
+
+        filters = []
+        if self.created_after:
+            filters.append(
+                MetadataFilter(
+                    key="created_timestamp",
+                    value=_timestamp(self.created_after),
+                    operator=FilterOperator.GTE,
+                )
+            )
+        if self.created_before:
+            filters.append(
+                MetadataFilter(
+                    key="created_timestamp",
+                    value=_timestamp(self.created_before, end_of_day=True),
+                    operator=FilterOperator.LTE,
+                )
+            )
+        if self.formats:
+            filters.append(
+                MetadataFilter(
+                    key="format", value=self.formats, operator=FilterOperator.IN
+                )
+            )
+        if self.dataset_ids:
+            filters.append(
+                MetadataFilter(
+                    key="id", value=self.dataset_ids, operator=FilterOperator.IN
+                )
+            )
+        return MetadataFilters(filters=filters) if filters else None
+
+
+class FilterIndex:
+    """Columnar copy of the chunk metadata used to build filter bitmaps.
+
+    Categorical columns are stored as integer codes into a sorted vocabulary, so
+    a filter compiles to a few vectorised comparisons over one array per column.
+    """
+
+    def __init__(self, metadata: list[dict]):
+        self.date_created = np.array(
+            [m.get("date_created", "NaT")[:10] for m in metadata],
+            dtype="datetime64[D]",
+        )
+        self.format_vocab, self.format = np.unique(
+            [m.get("format", "") for m in metadata], return_inverse=True
+        )
+        self.id_vocab, self.id = np.unique(
+            [m.get("id", "") for m in metadata], return_inverse=True
+        )
+
+    def bitmap(self, filters: SearchFilters) -> np.ndarray:
+        mask = np.ones(len(self.date_created), dtype=bool)
+        if filters.created_after:
+            mask &= self.date_created >= np.datetime64(filters.created_after)
+        if filters.created_before:
+            mask &= self.date_created <= np.datetime64(filters.created_before)
+        if filters.formats:
+            mask &= np.isin(self.format, _codes(self.format_vocab, filters.formats))
+        if filters.dataset_ids:
+            mask &= np.isin(self.id, _codes(self.id_vocab, filters.dataset_ids))
+        return mask
+
+
+def _codes(vocab: np.ndarray, values: list[str]) -> np.ndarray:
+    return np.flatnonzero(np.isin(vocab, values))
+
+
+def _timestamp(day: date, end_of_day: bool = False) -> int:
+    return int(datetime.combine(day, time.max if end_of_day else time.min).timestamp())
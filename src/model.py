@@ -1,13 +1,24 @@
+import logging
+from functools import cached_property
 from typing import Any
 
 from llama_index.core import PromptTemplate, QueryBundle, VectorStoreIndex
 from llama_index.core.postprocessor.types import BaseNodePostprocessor
-from llama_index.core.schema import NodeWithScore
+from llama_index.core.schema import NodeWithScore, TextNode
 from llama_index.embeddings.openai import OpenAIEmbedding, OpenAIEmbeddingMode
-from llama_index.llms.openai import OpenAI
 
+from src.common.metrics import span
 from src.common.utils import Settings
 from src.datastore import CreateDataStore
+from src.filter_index import SearchFilters
+from src.vector_index import (
+    FullPrecisionVectors,
+    QuantisedVectorIndex,
+    load_full_precision_vectors,
+    truncate,
+)
+
+GROUP_SEPARATOR = "\n--------------------\n"
 
 
 class DocumentGroupingPostprocessor(BaseNodePostprocessor):
@@ -24,7 +35,7 @@ class DocumentGroupingPostprocessor(BaseNodePostprocessor):
 
         out_nodes = []
         for group in nodes_by_document.values():
-            content = "\n--------------------\n".join([n.get_content() for n in group])
+            content = GROUP_SEPARATOR.join([n.get_content() for n in group])
             score = max(n.score for n in group)
             group[0].node.text = content
             group[0].score = score
@@ -32,6 +43,35 @@ class DocumentGroupingPostprocessor(BaseNodePostprocessor):
         return out_nodes
 
 
+class FullDimensionRerankPostprocessor(BaseNodePostprocessor):
+    """Re-rank candidates retrieved with truncated embeddings at full dimension."""
+
+    vectors: FullPrecisionVectors
+    top_k: int
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _postprocess_nodes(
+        self, nodes: list[NodeWithScore], query_bundle: QueryBundle | None = None
+    ) -> list[NodeWithScore]:
+        scores = self.vectors.score(
+            query_bundle.embedding, [n.node.node_id for n in nodes]  # type: ignore
+        )
+        # scores from the vector store are on another scale, so candidates without a
+        # full dimension vector cannot be ranked against the rest
+        unscored = [n for n in nodes if n.node.node_id not in scores]
+        if unscored:
+            logging.warning(
+                f"Dropping {len(unscored)} candidate(s) missing from data/vectors, "
+                "which is out of sync with the vector store."
+            )
+        nodes = [n for n in nodes if n.node.node_id in scores]
+        for node in nodes:
+            node.score = scores[node.node.node_id]
+        return sorted(nodes, key=lambda n: n.score, reverse=True)[: self.top_k]
+
+
 class LlamaIndexModel:
     def __init__(
         self,
@@ -40,8 +80,9 @@ class LlamaIndexModel:
         alpha: float,
         prompt: str,
         response_mode: str,
+        backend: str,
+        index: VectorStoreIndex | QuantisedVectorIndex | None = None,
     ):
-        self.llm = OpenAI(model="gpt-3.5-turbo")
         self.embed_model = OpenAIEmbedding(
             mode=OpenAIEmbeddingMode.TEXT_SEARCH_MODE, model="text-embedding-3-large"
         )
@@ -51,35 +92,82 @@ class LlamaIndexModel:
         self.alpha = alpha
         self.prompt = prompt
         self.response_mode = response_mode
+        self.backend = backend
 
-        self.index = self.build_index()
+        datastore = Settings().datastore
+        self.scan_dim = datastore.scan_dim
+        self.rerank = backend != "local" and datastore.scan_dim < datastore.embed_dim
+        self.oversample = Settings().vector_index.oversample
 
-    def run(self, query: str):
+        self.index = index if index is not None else self.build_index()
+
+    @cached_property
+    def llm(self):
+        # only needed to explain results, so keep it off the search path
+        from llama_index.llms.openai import OpenAI
+
+        return OpenAI(model="gpt-3.5-turbo")
+
+    def run(self, query: str, filters: SearchFilters | None = None):
         self.query = query
+        self.filters = filters or SearchFilters()
 
         self.response = self.build_response()
         self.processed_response = self.process_response(self.response)
 
     def build_index(self):
-        docstore = CreateDataStore(**Settings().datastore.model_dump())
-        docstore.setup_ingestion_pipeline()
-        return VectorStoreIndex.from_vector_store(
-            docstore.vector_store,
-            embed_model=self.embed_model,
-            show_progress=True,
-            use_async=True,
-        )
+        with span("query.build_index"):
+            if self.backend == "local":
+                return QuantisedVectorIndex(
+                    **Settings().vector_index.model_dump(), scan_dim=self.scan_dim
+                )
+
+            docstore = CreateDataStore(**Settings().datastore.model_dump())
+            docstore.setup_vector_store()
+            return VectorStoreIndex.from_vector_store(
+                docstore.vector_store,
+                embed_model=self.embed_model,
+                show_progress=True,
+                use_async=True,
+            )
 
     def build_response(self):
+        with span("query.embed"):
+            embedding = self.embed_model.get_query_embedding(self.query)
+        with span("query.vector_store"):
+            if isinstance(self.index, QuantisedVectorIndex):
+                response = self.index.retrieve(embedding, self.top_k, self.filters)
+            else:
+                response = self.retrieve_from_vector_store(embedding)
+        if self.rerank:
+            with span("query.rerank"):
+                postprocessor = FullDimensionRerankPostprocessor(
+                    vectors=load_full_precision_vectors(), top_k=self.top_k
+                )
+                response = postprocessor.postprocess_nodes(
+                    response, QueryBundle(self.query, embedding=embedding)
+                )
+        # kept so each grouped document can be dumped as the ids of its chunks
+        self.retrieved = response
+        with span("query.grouping"):
+            postprocessor = DocumentGroupingPostprocessor()
+            response = postprocessor.postprocess_nodes(response)
+        return response
+
+    def retrieve_from_vector_store(self, embedding: list[float]):
+        # with truncated embeddings the store is searched at scan_dim for extra
+        # candidates, which are then re-ranked at full dimension
+        if self.rerank:
+            embedding = truncate(embedding, self.scan_dim).tolist()
         retriever = self.index.as_retriever(
             vector_store_query_mode=self.vector_store_query_mode,
             alpha=self.alpha,
-            similarity_top_k=self.top_k,
+            similarity_top_k=(
+                self.top_k * self.oversample if self.rerank else self.top_k
+            ),
+            filters=self.filters.to_metadata_filters(),
         )
-        response = retriever.retrieve(self.query)
-        postprocessor = DocumentGroupingPostprocessor()
-        response = postprocessor.postprocess_nodes(response)
-        return response
+        return retriever.retrieve(QueryBundle(self.query, embedding=embedding))
 
     @staticmethod
     def process_response(response):
@@ -90,17 +178,57 @@ class LlamaIndexModel:
 
         return out
 
+    def dump_response(self) -> list[dict]:
+        """The grouped documents with the ids of their chunks rather than the text."""
+        node_ids: dict[str, list[str]] = {}
+        for r in self.retrieved:
+            node_ids.setdefault(r.node.metadata["id"], []).append(r.node.node_id)
+        return [
+            {
+                "node_ids": node_ids[r.node.metadata["id"]],
+                "metadata": r.node.metadata,
+                "score": r.score,
+            }
+            for r in self.response
+        ]
+
+    def load_response(self, query: str, response: list[dict]):
+        """Restore a response produced by ``dump_response``, possibly elsewhere."""
+        vectors = load_full_precision_vectors()
+        self.query = query
+        self.response = []
+        for r in response:
+            rows, ids = vectors.rows(r["node_ids"])
+            texts = {id: vectors.node(row)["text"] for row, id in zip(rows, ids)}
+            if len(texts) < len(r["node_ids"]):
+                logging.warning(
+                    f"{len(r['node_ids']) - len(texts)} chunk(s) of "
+                    f"{r['metadata']['id']} are missing from data/vectors."
+                )
+            text = GROUP_SEPARATOR.join(
+                texts[id] for id in r["node_ids"] if id in texts
+            )
+            self.response.append(
+                NodeWithScore(
+                    node=TextNode(text=text, metadata=r["metadata"]), score=r["score"]
+                )
+            )
+        self.processed_response = self.process_response(self.response)
+
     def explain_dataset(self, response_num: int):
         if not self.response or (response_num > len(self.response) - 1):
             raise ValueError("No response to explain")
 
         text_qa_template = PromptTemplate(self.prompt)
         response = self.response[response_num]
-        index = VectorStoreIndex(nodes=[response.node], embed_model=self.embed_model)
-        query_engine = index.as_query_engine(
-            text_qa_template=text_qa_template, llm=self.llm
-        )
-        response = query_engine.query(self.query)
+        with span("query.explain"):
+            index = VectorStoreIndex(
+                nodes=[response.node], embed_model=self.embed_model
+            )
+            query_engine = index.as_query_engine(
+                text_qa_template=text_qa_template, llm=self.llm
+            )
+            response = query_engine.query(self.query)
         self.explained_response = response.response
 
 
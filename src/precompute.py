@@ -0,0 +1,120 @@
+import csv
+import json
+import logging
+import re
+from pathlib import Path
+
+from tqdm import tqdm
+
+from src.common.utils import Paths, Settings
+
+
+def normalise_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def results_content(response: list[dict]) -> list[dict]:
+    """The dataset metadata and scores shown for a ``dump_response`` payload."""
+    return [{**r["metadata"], "score": r["score"]} for r in response]
+
+
+def load_precomputed_results(
+    path: Path = Paths.PRECOMPUTED_RESULTS,
+) -> dict[str, list[dict]]:
+    """Load the pre-materialised results, ignoring them if they are stale.
+
+    Results are only served if they were computed from the current datastore
+    build with the current settings, otherwise they would disagree with live
+    retrieval.
+    """
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        lookup = json.load(f)
+    if "datastore_build" not in lookup:
+        logging.warning(f"Ignoring {path} as it predates datastore versioning.")
+        return {}
+
+    if lookup["settings"] != _settings_fingerprint():
+        logging.warning(f"Ignoring {path} as it was built with different settings.")
+        return {}
+    if lookup["datastore_build"] != _datastore_build():
+        logging.warning(f"Ignoring {path} as it was built from another datastore.")
+        return {}
+    return lookup["results"]
+
+
+def _datastore_build(path: Path = Paths.DATASTORE_BUILD) -> str | None:
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)["build_id"]
+
+
+def _settings_fingerprint() -> dict:
+    settings = Settings()
+    model = settings.model.model_dump(exclude={"prompt", "response_mode"})
+    return {
+        "model": model,
+        "datastore": settings.datastore.model_dump(),
+        "vector_index": settings.vector_index.model_dump(),
+    }
+
+
+class PrecomputeResults:
+    def __init__(
+        self,
+        top_n: int,
+        query_log: Path = Paths.QUERY_LOG,
+        out_file: Path = Paths.PRECOMPUTED_RESULTS,
+    ):
+        self.top_n = top_n
+        self.query_log = query_log
+        self.out_file = out_file
+
+    def run(self):
+        if not self.query_log.exists():
+            return logging.error(f"Query log {self.query_log} does not exist.")
+
+        # imported here so the API can load the lookup without the llama-index stack
+        from src.model import LlamaIndexModel
+
+        self.model = LlamaIndexModel(**Settings().model.model_dump())
+        self.queries = self.read_head_queries()
+        self.results = self.compute_results()
+        self.write_results()
+
+    def read_head_queries(self) -> list[str]:
+        counts: dict[str, int] = {}
+        with open(self.query_log) as f:
+            for row in csv.DictReader(f):
+                query = normalise_query(row["column"])
+                if query:
+                    counts[query] = counts.get(query, 0) + int(row["count"])
+        return sorted(counts, key=counts.__getitem__, reverse=True)[: self.top_n]
+
+    def compute_results(self) -> dict[str, list[dict]]:
+        results = {}
+        for query in tqdm(self.queries, desc="Precomputing results"):
+            self.model.run(query)
+            # the ids of the retrieved chunks are kept so results served from the
+            # lookup can be explained without retrieving them again
+            results[query] = self.model.dump_response()
+        return results
+
+    def write_results(self) -> None:
+        with open(self.out_file, "w") as f:
+            json.dump(
+                {
+                    "settings": _settings_fingerprint(),
+                    "datastore_build": _datastore_build(),
+                    "results": self.results,
+                },
+                f,
+                separators=(",", ":"),
+            )
+
+
+if __name__ == "__main__":
+    precompute = PrecomputeResults(**Settings().precompute.model_dump())
+    precompute.run()
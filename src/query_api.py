@@ -8,6 +8,7 @@ from urllib.request import urlopen
 import requests
 from tqdm import tqdm
 
+from src.common.metrics import span
 from src.common.utils import Paths, Settings
 
 
@@ -41,7 +42,8 @@ class CDRCQuery:
         if self.check_if_files_changed():
             print("Files have changed.")
             self.files_changed = True
-            self.download_files()
+            with span("ingest.download"):
+                self.download_files()
         else:
             print("No files have changed.")
             self.files_changed = False
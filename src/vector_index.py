@@ -0,0 +1,384 @@
+import json
+import logging
+import mmap
+import os
+import tempfile
+from functools import cache, cached_property
+from pathlib import Path
+
+import numpy as np
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from src.common.utils import Paths, Settings
+from src.filter_index import FilterIndex, SearchFilters
+
+# number of set bits in each possible byte, used for hamming distances
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+SCAN_BATCH_SIZE = 65_536
+
+
+def write_vectors(
+    nodes, vectors_dir: Path = Paths.VECTORS_DIR, append: bool = False
+) -> None:
+    """Write embedded nodes as a float32 matrix with their text and metadata.
+
+    Row ``i`` of ``embeddings.npy`` belongs to line ``i`` of ``nodes.jsonl`` and
+    entry ``i`` of ``ids.npy``. With ``append`` the nodes are added to those
+    already written, replacing any with the same id, so the vectors keep matching
+    a vector store that was not overwritten. Any codes built from previous
+    embeddings are removed.
+    """
+    vectors_dir.mkdir(parents=True, exist_ok=True)
+    for path in [*vectors_dir.glob("codes-*.npy"), *vectors_dir.glob("scales-*.npy")]:
+        path.unlink()
+    nodes = [node for node in nodes if node.embedding is not None]
+    ids = [node.node_id for node in nodes]
+
+    embeddings = np.asarray([node.embedding for node in nodes], dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    previous, kept = None, np.empty(0, dtype=np.intp)
+    if append and (vectors_dir / "ids.npy").exists():
+        previous = FullPrecisionVectors(vectors_dir)
+        if previous.embeddings.shape[1] != embeddings.shape[1]:
+            raise ValueError(
+                f"Cannot append {embeddings.shape[1]} dimension vectors to the "
+                f"{previous.embeddings.shape[1]} dimension vectors in {vectors_dir}."
+            )
+        kept = np.flatnonzero(~np.isin(previous.ids, ids))
+
+    # written alongside and moved into place, as the previous files are still read
+    out = np.lib.format.open_memmap(
+        vectors_dir / "embeddings.tmp.npy",
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(kept) + len(nodes), embeddings.shape[1]),
+    )
+    with open(vectors_dir / "nodes.tmp.jsonl", "wb") as f:
+        if previous is not None:
+            for start in range(0, len(kept), SCAN_BATCH_SIZE):
+                rows = kept[start : start + SCAN_BATCH_SIZE]
+                out[start : start + len(rows)] = previous.embeddings[rows]
+                for row in rows:
+                    f.write(previous.nodes_file[_line(previous, row)])
+        for node in nodes:
+            record = {
+                "id": node.node_id,
+                "text": node.get_content(),
+                "metadata": node.metadata,
+            }
+            f.write(json.dumps(record).encode() + b"\n")
+    out[len(kept) :] = embeddings
+    out.flush()
+    del out
+
+    os.replace(vectors_dir / "embeddings.tmp.npy", vectors_dir / "embeddings.npy")
+    os.replace(vectors_dir / "nodes.tmp.jsonl", vectors_dir / "nodes.jsonl")
+    previous_ids = [] if previous is None else previous.ids[kept].tolist()
+    write_ids(previous_ids + ids, vectors_dir)
+
+
+def write_ids(ids: list[str], vectors_dir: Path = Paths.VECTORS_DIR) -> None:
+    """Write node ids in row order, with the order that sorts them for lookups."""
+    ids = np.asarray(ids, dtype=str)
+    _save_atomic(vectors_dir / "id_order.npy", np.argsort(ids))
+    _save_atomic(vectors_dir / "ids.npy", ids)
+
+
+def truncate(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """Shorten Matryoshka embeddings to their first ``dim`` values, renormalised."""
+    vectors = np.asarray(vectors, dtype=np.float32)[..., :dim]
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def quantise(
+    embeddings: np.ndarray, quantisation: str, dim: int
+) -> tuple[np.ndarray, np.ndarray | None]:
+    """Compress the first ``dim`` values of float vectors into int8 or binary codes.
+
+    int8 codes use a symmetric scale per dimension, returned alongside the codes
+    so it can be folded into the query at search time. Binary codes keep the
+    sign of each dimension, packed eight to a byte. float32 codes are only
+    truncated, which separates the loss from truncation and quantisation.
+    """
+    batches = range(0, len(embeddings), SCAN_BATCH_SIZE)
+    if quantisation == "float32":
+        codes = np.empty((len(embeddings), dim), dtype=np.float32)
+        for start in batches:
+            batch = truncate(embeddings[start : start + SCAN_BATCH_SIZE], dim)
+            codes[start : start + SCAN_BATCH_SIZE] = batch
+        return codes, None
+    if quantisation == "int8":
+        scales = np.zeros(dim, dtype=np.float32)
+        for start in batches:
+            batch = truncate(embeddings[start : start + SCAN_BATCH_SIZE], dim)
+            scales = np.maximum(scales, np.abs(batch).max(axis=0) / 127)
+        scales[scales == 0] = 1
+        codes = np.empty((len(embeddings), dim), dtype=np.int8)
+        for start in batches:
+            batch = truncate(embeddings[start : start + SCAN_BATCH_SIZE], dim)
+            codes[start : start + SCAN_BATCH_SIZE] = np.rint(batch / scales)
+        return codes, scales
+    if quantisation == "binary":
+        codes = np.empty((len(embeddings), (dim + 7) // 8), dtype=np.uint8)
+        for start in batches:
+            batch = embeddings[start : start + SCAN_BATCH_SIZE, :dim]
+            codes[start : start + SCAN_BATCH_SIZE] = np.packbits(batch > 0, axis=1)
+        return codes, None
+    raise ValueError(f"Unknown quantisation {quantisation}")
+
+
+class FullPrecisionVectors:
+    """Memory mapped float32 vectors and node records written by ``write_vectors``.
+
+    Node records are read on demand from a shared mapping rather than parsed into
+    every worker process, and ids are found by binary search over ``ids.npy``.
+    """
+
+    def __init__(self, vectors_dir: Path = Paths.VECTORS_DIR):
+        self.vectors_dir = vectors_dir
+        self.embeddings = np.load(vectors_dir / "embeddings.npy", mmap_mode="r")
+        self.ids = np.load(vectors_dir / "ids.npy", mmap_mode="r")
+        self.id_order = np.load(vectors_dir / "id_order.npy", mmap_mode="r")
+
+        with open(vectors_dir / "nodes.jsonl", "rb") as f:
+            self.nodes_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        newlines = np.flatnonzero(np.frombuffer(self.nodes_file, dtype=np.uint8) == 10)
+        self.node_offsets = np.concatenate([[0], newlines + 1])
+
+    def __len__(self) -> int:
+        return len(self.node_offsets) - 1
+
+    def node(self, row: int) -> dict:
+        start, end = self.node_offsets[row], self.node_offsets[row + 1]
+        return json.loads(self.nodes_file[start:end])
+
+    def rows(self, ids: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Rows of the given node ids in ascending order, with the ids found."""
+        ids = np.asarray(ids, dtype=str)
+        if len(ids) == 0 or len(self.ids) == 0:
+            return np.empty(0, dtype=np.intp), ids[:0]
+        positions = np.searchsorted(self.ids, ids, sorter=self.id_order)
+        rows = self.id_order[np.minimum(positions, len(self.ids) - 1)]
+        found = self.ids[rows] == ids
+        rows, ids = rows[found], ids[found]
+        order = np.argsort(rows)
+        return rows[order], ids[order]
+
+    def score(self, query: np.ndarray, ids: list[str]) -> dict[str, float]:
+        """Exact cosine scores for the given node ids, skipping unknown ids."""
+        rows, ids = self.rows(ids)
+        if len(rows) == 0:
+            return {}
+        scores = self.embeddings[rows] @ _normalise(query)
+        return {str(id): float(score) for id, score in zip(ids, scores)}
+
+
+@cache
+def load_full_precision_vectors(
+    vectors_dir: Path = Paths.VECTORS_DIR,
+) -> FullPrecisionVectors:
+    return FullPrecisionVectors(vectors_dir)
+
+
+class QuantisedVectorIndex(FullPrecisionVectors):
+    """Local dense index that scans compressed codes and rescores exactly.
+
+    The codes hold the first ``scan_dim`` values of each Matryoshka embedding,
+    renormalised. They are scanned for ``top_k * oversample`` candidates, which
+    are then rescored against the full precision, full dimension vectors. Both
+    are memory mapped so only the rows that are rescored are read from the
+    float32 matrix.
+    """
+
+    def __init__(
+        self,
+        quantisation: str,
+        oversample: int,
+        scan_dim: int,
+        vectors_dir: Path = Paths.VECTORS_DIR,
+        codes_dir: Path | None = None,
+    ):
+        super().__init__(vectors_dir)
+        self.quantisation = quantisation
+        self.oversample = oversample
+        self.scan_dim = min(scan_dim, self.embeddings.shape[1])
+        self.codes_dir = codes_dir or vectors_dir
+
+        if not self.codes_path.exists():
+            self.build()
+        self.codes = np.load(self.codes_path, mmap_mode="r")
+        self.scales = np.load(self.scales_path) if self.quantisation == "int8" else None
+
+    @property
+    def codes_path(self) -> Path:
+        return self.codes_dir / f"codes-{self.quantisation}-{self.scan_dim}.npy"
+
+    @property
+    def scales_path(self) -> Path:
+        return self.codes_dir / f"scales-{self.quantisation}-{self.scan_dim}.npy"
+
+    def build(self) -> None:
+        codes, scales = quantise(self.embeddings, self.quantisation, self.scan_dim)
+        # scales go first as the codes existing is what marks the build as done
+        if scales is not None:
+            _save_atomic(self.scales_path, scales)
+        _save_atomic(self.codes_path, codes)
+
+    @cached_property
+    def filter_index(self) -> FilterIndex:
+        return FilterIndex([self.node(row)["metadata"] for row in range(len(self))])
+
+    def scan(
+        self, query: np.ndarray, k: int, mask: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Return the rows of the ``k`` best candidates by compressed score.
+
+        Only rows set in ``mask`` are read, so filtered scans touch fewer codes.
+        """
+        query = truncate(query, self.scan_dim)
+        if self.quantisation == "int8":
+            query = query * self.scales
+        elif self.quantisation == "binary":
+            query = np.packbits(query > 0)
+
+        rows, scores = None, []
+        if mask is not None:
+            rows = np.flatnonzero(mask)
+        for batch in _batches(self.codes, rows):
+            if self.quantisation == "binary":
+                scores.append(-POPCOUNT[batch ^ query].sum(axis=1, dtype=np.float32))
+            else:
+                scores.append(batch.astype(np.float32, copy=False) @ query)
+        return _select(_top_k(_concat(scores), k), rows)
+
+    def search(
+        self, query: np.ndarray, top_k: int, mask: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        query = _normalise(query)
+        candidates = np.sort(self.scan(query, top_k * self.oversample, mask))
+        scores = self.embeddings[candidates] @ query
+        best = _top_k(scores, top_k)
+        return candidates[best], scores[best]
+
+    def exact_search(
+        self, query: np.ndarray, top_k: int, mask: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        query = _normalise(query)
+        rows = np.flatnonzero(mask) if mask is not None else None
+        scores = _concat([batch @ query for batch in _batches(self.embeddings, rows)])
+        best = _top_k(scores, top_k)
+        return _select(best, rows), scores[best]
+
+    def retrieve(
+        self, query: list[float], top_k: int, filters: SearchFilters | None = None
+    ) -> list[NodeWithScore]:
+        mask = None
+        if filters is not None and not filters.is_empty():
+            mask = self.filter_index.bitmap(filters)
+        rows, scores = self.search(np.asarray(query, dtype=np.float32), top_k, mask)
+        out = []
+        for row, score in zip(rows, scores):
+            node = self.node(row)
+            out.append(
+                NodeWithScore(
+                    node=TextNode(
+                        id_=node["id"], text=node["text"], metadata=node["metadata"]
+                    ),
+                    score=float(score),
+                )
+            )
+        return out
+
+    def memory_footprint(self) -> dict[str, float]:
+        return {
+            "float32_bytes": self.embeddings.nbytes,
+            "codes_bytes": self.codes.nbytes,
+            "compression": round(self.embeddings.nbytes / self.codes.nbytes, 1),
+        }
+
+    def recall_at_k(self, top_k: int, n_queries: int = 100, seed: int = 0) -> float:
+        """Mean overlap between the quantised and exact full dimension top ``k``.
+
+        Stored vectors are used as queries, with noise added so a query is not
+        trivially its own nearest neighbour.
+        """
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(
+            len(self.embeddings), min(n_queries, len(self.embeddings)), replace=False
+        )
+        recalls = []
+        for row in rows:
+            query = self.embeddings[row] + rng.normal(
+                scale=0.01, size=self.embeddings.shape[1]
+            )
+            approx, _ = self.search(query, top_k)
+            exact, _ = self.exact_search(query, top_k)
+            recalls.append(len(set(approx) & set(exact)) / len(exact))
+        return float(np.mean(recalls))
+
+
+def _save_atomic(path: Path, array: np.ndarray) -> None:
+    # every worker may build the same missing codes, so readers must only ever
+    # see a complete file
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".npy", delete=False) as f:
+        np.save(f, array)
+    os.replace(f.name, path)
+
+
+def _line(vectors: FullPrecisionVectors, row: int) -> slice:
+    return slice(vectors.node_offsets[row], vectors.node_offsets[row + 1])
+
+
+def _normalise(query: np.ndarray) -> np.ndarray:
+    query = np.asarray(query, dtype=np.float32)
+    return query / np.linalg.norm(query)
+
+
+def _batches(matrix: np.ndarray, rows: np.ndarray | None):
+    n = len(matrix) if rows is None else len(rows)
+    for start in range(0, n, SCAN_BATCH_SIZE):
+        if rows is None:
+            yield matrix[start : start + SCAN_BATCH_SIZE]
+        else:
+            yield matrix[rows[start : start + SCAN_BATCH_SIZE]]
+
+
+def _concat(scores: list[np.ndarray]) -> np.ndarray:
+    return np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+
+
+def _select(positions: np.ndarray, rows: np.ndarray | None) -> np.ndarray:
+    return positions if rows is None else rows[positions]
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    settings = Settings()
+    embed_dim = settings.datastore.embed_dim
+    scan_dims = sorted({256, 512, 1024, settings.datastore.scan_dim, embed_dim})
+    # float32 codes are only truncated, so they give the recall lost to truncation
+    # alone for each scan_dim, before any quantisation
+    with tempfile.TemporaryDirectory() as codes_dir:
+        for scan_dim in [dim for dim in scan_dims if dim <= embed_dim]:
+            for quantisation in ["float32", "int8", "binary"]:
+                index = QuantisedVectorIndex(
+                    **settings.vector_index.model_dump(exclude={"quantisation"}),
+                    quantisation=quantisation,
+                    scan_dim=scan_dim,
+                    codes_dir=Path(codes_dir),
+                )
+                logging.info(
+                    f"{quantisation}, scan_dim={scan_dim}: {index.memory_footprint()}, "
+                    f"recall@{settings.model.top_k} = "
+                    f"{index.recall_at_k(settings.model.top_k):.3f}"
+                )
@@ -1,29 +1,31 @@
+import json
 import os
 
 import nomic
 import numpy as np
-import pinecone
 from nomic import atlas
 
-pinecone.init(api_key=os.environ.get("PINECONE_API_KEY"), environment="gcp-starter")
+from src.common.utils import Paths
+
+# run `python -m src.export_embeddings` first to page the vectors out of pinecone,
+# otherwise the vectors written by the datastore are used
 nomic.login(os.environ.get("NOMIC_API_KEY"))
 
-index = pinecone.Index("cdrc")
-ids = [
-    result["id"] for result in index.query([0] * 768, top_k=10000).to_dict()["matches"]
-][:1000]
-result = index.fetch(ids=ids)
-result.to_dict()["vectors"].keys()
-ids = [r for r in result.to_dict()["vectors"].keys()]
-embeddings = np.array([r["values"] for r in result.to_dict()["vectors"].values()])
-titles = np.array(
-    [r["metadata"]["title"] for r in result.to_dict()["vectors"].values()]
-)
+vectors_dir = Paths.EXPORT_DIR
+if not (vectors_dir / "embeddings.npy").exists():
+    vectors_dir = Paths.VECTORS_DIR
+
+embeddings = np.load(vectors_dir / "embeddings.npy", mmap_mode="r")
+with open(vectors_dir / "nodes.jsonl") as f:
+    data = [
+        {"id": node["id"], "title": node["metadata"].get("title")}
+        for node in map(json.loads, f)
+    ]
 
 
 atlas.map_embeddings(
     embeddings=embeddings,
-    data=[{"id": id, "title": title} for id, title in zip(ids, titles)],
+    data=data,
     id_field="id",
     name="cdrc",
     reset_project_if_exists=True,